@@ -1,139 +1,365 @@
-import json
-import dbus_next
-from dbus_next.introspection import Interface, Node
+from dbus_next.introspection import Node
 from dbus_next.aio.proxy_object import ProxyInterface, ProxyObject
-import platform
 import asyncio
 import sys
+from dataclasses import replace
 from threading import Thread, Event
-from typing import Any, List, Optional, cast, override
+from typing import Any, Callable, Coroutine, Optional, cast, override
+from dbus_next.signature import Variant
 from .MediaControllerTypes import MediaPlaybackStateInner, default_media_playback_state, MediaControllerBase
 from lib.Logger import log
 
-if platform.system() == "Linux":
+if sys.platform.startswith("linux"):
     from dbus_next.aio.message_bus import MessageBus
-    from dbus_next.constants import BusType
+    from dbus_next.constants import MessageType
+    from dbus_next.message import Message
 else:
     MessageBus = None
 
-import time
+MPRIS_PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
+MPRIS_NAME_PREFIX = "org.mpris.MediaPlayer2."
+# Seconds to wait for a player to answer while probing. An unresponsive player would otherwise stall for the 25 second dbus default.
+MPRIS_PROBE_TIMEOUT = 1.0
+# Seconds before probing a new player again when it was not ready yet, since no further signal announces it.
+MPRIS_APPEARED_RETRY_DELAY = 1.0
+# Seconds to wait for further property changes before notifying, so a track change produces a single notification.
+MPRIS_STATE_DEBOUNCE = 0.05
+# Let the bus daemon push only ownership changes of MPRIS names, instead of re-scanning ListNames.
+MPRIS_NAME_OWNER_CHANGED_RULE = "type='signal',sender='org.freedesktop.DBus',interface='org.freedesktop.DBus',member='NameOwnerChanged',arg0namespace='org.mpris.MediaPlayer2'"
+
+
+def _unwrap(metadata: dict[str, Variant], key: str) -> Any:
+    variant = metadata.get(key)
+    return variant.value if variant is not None else None
 
 
 class MPRISController(MediaControllerBase):
+    __slots__ = (
+        "_loop", "_stop_event", "_last_state", "_last_artists_list", "_last_artists",
+        "_pending_state", "_pending_state_handle", "_bus", "_mpris_names", "_player_proxies",
+        "_player_lock", "_player_iface", "_props_iface", "_owns_loop", "_loop_thread", "_init_task", "_tasks",
+    )
+
     def __init__(self):
         super().__init__()
         if MessageBus is None:
             log('error', 'MPRISController requires dbus-next, which is not available on this platform.')
             raise NotImplementedError("MPRISController is not implemented for this platform.")
 
-        self._loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        # Run on the host's event loop when created from it, instead of paying for a second loop and thread.
+        try:
+            self._loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            self._owns_loop: bool = False
+        except RuntimeError:
+            self._loop = asyncio.new_event_loop()
+            # Most tasks on this loop finish or block on dbus I/O right away, so start them eagerly.
+            self._loop.set_task_factory(asyncio.eager_task_factory)
+            self._owns_loop = True
         self._stop_event: Event = Event()
         self._last_state: Optional[MediaPlaybackStateInner] = None
+        self._last_artists_list: list[str] | None = None
+        self._last_artists: str | None = None
+        self._pending_state: Optional[MediaPlaybackStateInner] = None
+        self._pending_state_handle: asyncio.TimerHandle | None = None
+        self._bus: MessageBus | None = None
+        self._mpris_names: list[str] = []
+        # Proxies are built once per player and kept until the player leaves the bus.
+        self._player_proxies: dict[str, ProxyObject] = {}
+        self._player_lock: asyncio.Lock = asyncio.Lock()
         self._player_iface: ProxyInterface | None = None
+        self._props_iface: ProxyInterface | None = None
 
-        self._poll_thread: Thread = Thread(target=self._run, daemon=True)
-        self._poll_thread.start()
+        # Tasks started by bus signals, cancelled on cleanup so none of them outlives the controller.
+        self._tasks: set[asyncio.Task] = set()
+
+        self._loop_thread: Thread | None = None
+        self._init_task: asyncio.Task | None = None
+        if self._owns_loop:
+            self._loop_thread = Thread(target=self._run, daemon=True)
+            self._loop_thread.start()
+        else:
+            self._start_init_task()
 
     def _run(self):
         asyncio.set_event_loop(self._loop)
-        self._loop.run_until_complete(self._init_player())
-        while not self._stop_event.is_set():
-            self._loop.run_until_complete(self._poll())
-            time.sleep(1)
+        self._start_init_task()
+        # State updates arrive through PropertiesChanged signals once initialized, until cleanup() stops the loop.
+        self._loop.run_forever()
+        # Let the cancelled tasks unwind before closing the loop.
+        pending = asyncio.all_tasks(self._loop)
+        for task in pending:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        self._loop.close()
+
+    def _start_init_task(self):
+        self._init_task = self._loop.create_task(self._init_player())
+        self._init_task.add_done_callback(self._on_init_done)
+
+    def _on_init_done(self, task: asyncio.Task):
+        # Nothing awaits the init task, so report its failure here instead of leaving it unretrieved.
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            log('error', 'Failed to initialize the MPRIS controller: ', e)
 
     async def _init_player(self):
         if not MessageBus:
             log('error', 'MPRISController requires dbus-next, which is not available on this platform.')
             raise NotImplementedError("MPRISController is not implemented for this platform.")
         
-        self._bus = await MessageBus().connect()
+        # Keep the bus before connecting, so cleanup() can disconnect it even if connecting is cancelled.
+        self._bus = MessageBus()
+        await self._bus.connect()
+        await self._watch_player_names()
         names = await self._list_names()
-        mpris_names = [name for name in names if name.startswith("org.mpris.MediaPlayer2.")]
-        log('debug', f'MPRIS names found: {mpris_names}')
+        self._mpris_names = [name for name in names if name.startswith(MPRIS_NAME_PREFIX)]
+        log('debug', 'MPRIS names found: ', self._mpris_names)
+        async with self._player_lock:
+            await self._select_player(self._mpris_names)
+
+    async def _select_player(self, mpris_names: list[str]):
+        # Probe all candidates concurrently, so startup waits for the slowest player rather than the sum of them.
+        tasks = [asyncio.create_task(self._probe_player(name)) for name in mpris_names]
+        probed: dict[str, tuple[ProxyObject, ProxyInterface]] = {}
+        active: tuple[ProxyObject, ProxyInterface] | None = None
+        try:
+            for next_probe in asyncio.as_completed(tasks):
+                probe = await next_probe
+                if probe is None:
+                    continue
+                name, proxy_obj, player_iface, status = probe
+                if status == "Playing":
+                    active = (proxy_obj, player_iface)
+                    break
+                probed[name] = (proxy_obj, player_iface)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if active is not None:
+            await self._use_player(*active)
+            return
+        # fallback to first player found
         for name in mpris_names:
+            if name in probed:
+                log('debug', 'No active MPRIS player found, using the first available player.')
+                await self._use_player(*probed[name])
+                return
+
+    async def _probe_player(self, name: str) -> tuple[str, ProxyObject, ProxyInterface, str] | None:
+        try:
+            proxy_obj: ProxyObject | None = self._player_proxies.get(name)
+            if proxy_obj is None:
+                introspection: Node = await asyncio.wait_for(self._bus.introspect(name, "/org/mpris/MediaPlayer2"), timeout=MPRIS_PROBE_TIMEOUT)
+                proxy_obj = self._bus.get_proxy_object(name, "/org/mpris/MediaPlayer2", introspection)
+            player_iface: ProxyInterface = proxy_obj.get_interface("org.mpris.MediaPlayer2.Player")
+            # Only cache proxies that export the player interface. A player that claimed its name before exporting
+            # its object is introspected again on the next probe.
+            self._player_proxies[name] = proxy_obj
+
+            status: str = await asyncio.wait_for(player_iface.get_playback_status(), timeout=MPRIS_PROBE_TIMEOUT)
+            log('debug', 'Player status: ', name, status)
+            return name, proxy_obj, player_iface, status
+        except TimeoutError:
+            log('debug', 'Player did not respond in time, skipping: ', name)
+            return None
+        except Exception as e:
+            log('debug', 'Failed to introspect or get player interface, continuing: ', name)
+            log('debug', 'Exception details: ', e)
+            return None
+
+    async def _watch_player_names(self):
+        reply = await self._bus.call(Message(
+            destination="org.freedesktop.DBus",
+            path="/org/freedesktop/DBus",
+            interface="org.freedesktop.DBus",
+            member="AddMatch",
+            signature="s",
+            body=[MPRIS_NAME_OWNER_CHANGED_RULE]
+        ))
+        if reply is None or reply.message_type != MessageType.METHOD_RETURN:
+            log('error', 'Failed to watch MPRIS players appearing and disappearing: ', reply.body if reply else None)
+            return
+        self._bus.add_message_handler(self._on_bus_message)
+
+    def _on_bus_message(self, msg: Message):
+        if msg.message_type != MessageType.SIGNAL or msg.interface != "org.freedesktop.DBus" or msg.member != "NameOwnerChanged":
+            return
+        name, old_owner, new_owner = msg.body
+        if not name.startswith(MPRIS_NAME_PREFIX):
+            return
+        if new_owner and not old_owner:
+            log('debug', 'MPRIS player appeared: ', name)
+            if name not in self._mpris_names:
+                self._mpris_names.append(name)
+            self._spawn(self._on_player_appeared(name))
+        elif old_owner and not new_owner:
+            log('debug', 'MPRIS player disappeared: ', name)
+            if name in self._mpris_names:
+                self._mpris_names.remove(name)
+            self._player_proxies.pop(name, None)
+            self._spawn(self._on_player_disappeared(name))
+
+    async def _on_player_appeared(self, name: str, retry: bool = True):
+        async with self._player_lock:
+            # Keep a player that is currently playing; otherwise prefer the newcomer.
+            if self._player_iface is not None and self.get_media_playback_state().playback_status == "Playing":
+                return
             try:
-                introspection: Node = await self._bus.introspect(name, "/org/mpris/MediaPlayer2")
-                proxy_obj: ProxyObject = self._bus.get_proxy_object(name, "/org/mpris/MediaPlayer2", introspection)
-                player_iface: ProxyInterface = proxy_obj.get_interface("org.mpris.MediaPlayer2.Player")
-                
-                status: str = await player_iface.get_playback_status()
-                log('debug', f'Player {name} status: {status}')
-                if status == "Playing":
-                    self._player_iface = player_iface
+                # Players often claim their name before exporting their object, so only switch once the newcomer answers.
+                probe = await self._probe_player(name)
+                if probe is not None:
+                    _, proxy_obj, player_iface, _ = probe
+                    self._release_player()
+                    await self._use_player(proxy_obj, player_iface)
                     return
-            except Exception:
-                log('debug', f'Failed to introspect or get player interface for {name}, continuing...')
-                log('debug', f'Exception details: {sys.exc_info()[1]}')
-                continue
-        # fallback to first player found
-        if mpris_names:
-            log('debug', 'No active MPRIS player found, using the first available player.')
-            introspection = await self._bus.introspect(mpris_names[0], "/org/mpris/MediaPlayer2")
-            proxy_obj = self._bus.get_proxy_object(mpris_names[0], "/org/mpris/MediaPlayer2", introspection)
-            self._player_iface = proxy_obj.get_interface("org.mpris.MediaPlayer2.Player")
+                if retry:
+                    self._spawn(self._retry_player_appeared(name))
+                if self._player_iface is None:
+                    await self._select_player([other for other in self._mpris_names if other != name])
+                else:
+                    log('debug', 'New MPRIS player is not ready, keeping the current player: ', name)
+            except Exception as e:
+                log('error', 'Failed to switch to MPRIS player: ', name)
+                log('debug', 'Exception details: ', e)
+
+    async def _retry_player_appeared(self, name: str):
+        await asyncio.sleep(MPRIS_APPEARED_RETRY_DELAY)
+        if name in self._mpris_names:
+            await self._on_player_appeared(name, retry=False)
+
+    async def _on_player_disappeared(self, name: str):
+        async with self._player_lock:
+            if self._player_iface is None or self._player_iface.bus_name != name:
+                return
+            try:
+                self._release_player()
+                self._set_state(default_media_playback_state())
+                await self._select_player(self._mpris_names)
+            except Exception as e:
+                log('error', 'Failed to select another MPRIS player')
+                log('debug', 'Exception details: ', e)
+
+    async def _use_player(self, proxy_obj: ProxyObject, player_iface: ProxyInterface):
+        # Fix the Shuffle property, since VLC is being stupid.
+        for prop in player_iface.introspection.properties:
+            if prop.name == "Shuffle" and prop.signature == "d":
+                # Fix the type of Shuffle property to boolean
+                prop.signature = "b"
+                break
+        self._player_iface = player_iface
+
+        # Listen for property changes instead of polling, and seed the cached state once.
+        self._props_iface = proxy_obj.get_interface("org.freedesktop.DBus.Properties")
+        self._props_iface.on_properties_changed(self._on_properties_changed)
+        self._set_state(await self._get_media_playback_state())
+
+    def _release_player(self):
+        if self._props_iface is not None:
+            self._props_iface.off_properties_changed(self._on_properties_changed)
+        self._player_iface = None
+        self._props_iface = None
 
     async def _list_names(self) -> list[str]:
-        introspection = await self._bus.introspect("org.freedesktop.DBus", "/org/freedesktop/DBus")
-        proxy = self._bus.get_proxy_object("org.freedesktop.DBus", "/org/freedesktop/DBus", introspection)
-        iface = proxy.get_interface("org.freedesktop.DBus")
-        return await iface.call_list_names()
+        # The bus daemon's interface is fixed, so call ListNames directly instead of introspecting it first.
+        reply = await self._bus.call(Message(
+            destination="org.freedesktop.DBus",
+            path="/org/freedesktop/DBus",
+            interface="org.freedesktop.DBus",
+            member="ListNames"
+        ))
+        if reply is None or reply.message_type != MessageType.METHOD_RETURN:
+            log('error', 'Failed to list DBus names: ', reply.body if reply else None)
+            return []
+        return reply.body[0]
 
-    async def _poll(self):
-        if not self._player_iface:
+    def _on_properties_changed(self, interface_name: str, changed_properties: dict[str, Variant], invalidated_properties: list[str]):
+        if interface_name != MPRIS_PLAYER_INTERFACE:
+            return
+        if invalidated_properties:
+            # Invalidated properties carry no value, so fetch the full state again.
+            self._spawn(self._refresh_state())
             return
         try:
-            state = await self._get_media_playback_state()
-            if state != self._last_state:
-                log('debug', f'Media playback state changed: {state}')
-                self._last_state = state
-                if self.on_media_playback_info_changed:
-                    self.on_media_playback_info_changed(state)
-        except Exception:
-            log('error', 'Error while polling media playback state')
-            log('debug', f'Exception details: {sys.exc_info()[1]}')
-            pass
+            state = self._apply_properties(self._pending_state or self._last_state or default_media_playback_state(), changed_properties)
+            self._queue_state(state)
+        except Exception as e:
+            log('error', 'Error while handling media playback state change')
+            log('debug', 'Exception details: ', e)
+
+    async def _refresh_state(self):
+        self._queue_state(await self._get_media_playback_state())
+
+    def _queue_state(self, state: MediaPlaybackStateInner):
+        # Debounce: every change restarts the timer, and only the merged state is published.
+        self._pending_state = state
+        if self._pending_state_handle is not None:
+            self._pending_state_handle.cancel()
+        self._pending_state_handle = self._loop.call_later(MPRIS_STATE_DEBOUNCE, self._publish_pending_state)
+
+    def _publish_pending_state(self):
+        state = self._pending_state
+        self._pending_state_handle = None
+        self._pending_state = None
+        if state is not None:
+            self._set_state(state)
+
+    def _cancel_pending_state(self):
+        if self._pending_state_handle is not None:
+            self._pending_state_handle.cancel()
+            self._pending_state_handle = None
+        self._pending_state = None
+
+    def _set_state(self, state: MediaPlaybackStateInner):
+        # Any queued changes are superseded by this state.
+        self._cancel_pending_state()
+        if state == self._last_state:
+            return
+        log('debug', 'Media playback state changed: ', state)
+        self._last_state = state
+        if self.on_media_playback_info_changed:
+            self.on_media_playback_info_changed(state)
+
+    def _metadata_fields(self, metadata: dict[str, Variant]) -> tuple[str | None, str | None, str | None]:
+        artists_list = cast(list[str] | None, _unwrap(metadata, "xesam:artist"))
+
+        # Concatenate artists, reusing the previous string when the artists did not change.
+        # Each signal decodes a fresh list, so compare by value rather than identity.
+        if artists_list != self._last_artists_list:
+            self._last_artists_list = artists_list
+            self._last_artists = ', '.join(artists_list) if artists_list else None
+        artists = self._last_artists
+        subtitle = cast(str | None, _unwrap(metadata, "xesam:album"))
+        title = cast(str | None, _unwrap(metadata, "xesam:title"))
+        return artists, subtitle, title
+
+    def _apply_properties(self, state: MediaPlaybackStateInner, properties: dict[str, Variant]) -> MediaPlaybackStateInner:
+        changes: dict[str, Any] = {}
+        if "Metadata" in properties:
+            changes["artist"], changes["subtitle"], changes["title"] = self._metadata_fields(properties["Metadata"].value)
+        if "PlaybackStatus" in properties:
+            changes["playback_status"] = properties["PlaybackStatus"].value
+        if "Shuffle" in properties:
+            changes["is_shuffle_active"] = bool(properties["Shuffle"].value)
+        if "LoopStatus" in properties:
+            changes["auto_repeat_mode"] = properties["LoopStatus"].value
+        return replace(state, **changes) if changes else state
 
     async def _get_media_playback_state(self) -> MediaPlaybackStateInner:
-        if not self._player_iface:
+        if not self._player_iface or not self._props_iface:
             log('debug', 'No player interface available, returning default state')
             return default_media_playback_state()
         try:
-            metadata = await self._player_iface.get_metadata()
-            playback_status = await self._player_iface.get_playback_status()
-
-            # Fix the Shuffle property, since VLC is being stupid.
-            introspection: Node = self._player_iface.introspection
-            for prop in introspection.properties:
-                # log('debug', vars(prop))
-                if prop.name == "Shuffle" and prop.signature == "d":
-                    # log('debug', f'Found Incorrect Shuffle property: {prop.name} with type {prop.signature}. Fixing to boolean.')
-                    # Fix the type of Shuffle property to boolean
-                    prop.signature = "b"
-                    
-            shuffle = cast(bool, await self._player_iface.get_shuffle()) if hasattr(self._player_iface, 'get_shuffle') else None
-            # if hasattr(self._player_iface, 'get_shuffle'):
-            #     log('debug', f'get_shuffle: {shuffle}')
-            loop_status = await self._player_iface.get_loop_status() if hasattr(self._player_iface, 'get_loop_status') else None
-            # shuffle = False
-            # loop_status = None
-            artists_list = cast(list[str], (cast(dbus_next.signature.Variant, metadata.get("xesam:artist")) or {"value":None}).value)
-
-            # Concatenate artists
-            artists = ', '.join(artists_list) if artists_list else None
-
-            return {
-                "artist": artists,
-                "subtitle": cast(str, (cast(dbus_next.signature.Variant, metadata.get("xesam:album")) or {"value":None}).value),
-                "title": cast(str, (cast(dbus_next.signature.Variant, metadata.get("xesam:title")) or {"value":None}).value),
-                "is_shuffle_active": bool(shuffle) if shuffle is not None else None,
-                "auto_repeat_mode": loop_status,
-                "playback_status": playback_status
-            }
-        except Exception:
+            # Fetch every player property in a single round-trip.
+            all_props: dict[str, Variant] = await self._props_iface.call_get_all(MPRIS_PLAYER_INTERFACE)
+            # Optional properties (Shuffle, LoopStatus) stay None when the player doesn't expose them.
+            empty_state = MediaPlaybackStateInner(is_shuffle_active=None)
+            return self._apply_properties(empty_state, all_props)
+        except Exception as e:
             log('error', 'Error getting media playback state')
-            log('debug', f'Exception details: {sys.exc_info()[1]}')
-            # Print exception location for debugging
-            log('debug', f'Exception location: {sys.exc_info()[2].tb_frame.f_code.co_filename}:{sys.exc_info()[2].tb_lineno}')
+            log('debug', 'Exception details: ', e)
             return default_media_playback_state()
 
     # async def _safe_get_property(self, prop):
@@ -142,42 +368,68 @@ class MPRISController(MediaControllerBase):
     #     except Exception:
     #         return None
 
-    @staticmethod
-    def _run_coroutine_in_loop(loop: asyncio.AbstractEventLoop, coro):
-        asyncio.run_coroutine_threadsafe(coro, loop)
+    def _spawn(self, coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _on_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _create_task_threadsafe(self, coro_factory: Callable[[], Coroutine[Any, Any, Any]]):
+        if self._on_loop_thread():
+            self._spawn_command(coro_factory)
+            return
+        # Fire-and-forget: the coroutine is created on the loop thread, so nothing is left un-awaited if the loop is gone.
+        self._loop.call_soon_threadsafe(self._spawn_command, coro_factory)
+
+    def _spawn_command(self, coro_factory: Callable[[], Coroutine[Any, Any, Any]]):
+        self._spawn(coro_factory()).add_done_callback(self._on_command_done)
+
+    def _on_command_done(self, task: asyncio.Task):
+        # Nothing awaits player commands, so report their failure here instead of leaving it unretrieved.
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            log('error', 'MPRIS player command failed: ', e)
 
     @override
     def play(self) -> bool:
         if self._player_iface:
-            self._run_coroutine_in_loop(self._loop, self._player_iface.call_play())
+            self._create_task_threadsafe(self._player_iface.call_play)
             return True
         return False
 
     @override
     def pause(self) -> bool:
         if self._player_iface:
-            self._run_coroutine_in_loop(self._loop, self._player_iface.call_pause())
+            self._create_task_threadsafe(self._player_iface.call_pause)
             return True
         return False
 
     @override
     def stop(self) -> bool:
         if self._player_iface:
-            self._run_coroutine_in_loop(self._loop, self._player_iface.call_stop())
+            self._create_task_threadsafe(self._player_iface.call_stop)
             return True
         return False
 
     @override
     def prev_track(self) -> bool:
         if self._player_iface:
-            self._run_coroutine_in_loop(self._loop, self._player_iface.call_previous())
+            self._create_task_threadsafe(self._player_iface.call_previous)
             return True
         return False
 
     @override
     def next_track(self) -> bool:
         if self._player_iface:
-            self._run_coroutine_in_loop(self._loop, self._player_iface.call_next())
+            self._create_task_threadsafe(self._player_iface.call_next)
             return True
         return False
 
@@ -187,6 +439,31 @@ class MPRISController(MediaControllerBase):
 
     @override
     def cleanup(self):
+        if self._stop_event.is_set():
+            return
         self._stop_event.set()
-        self._poll_thread.join(timeout=2)
-        self._loop.stop()
+        if self._on_loop_thread():
+            self._shutdown()
+        else:
+            self._loop.call_soon_threadsafe(self._shutdown)
+        if self._loop_thread is not None:
+            self._loop_thread.join(timeout=2)
+
+    def _shutdown(self):
+        if self._init_task is not None:
+            self._init_task.cancel()
+        for task in self._tasks:
+            task.cancel()
+        self._cancel_pending_state()
+        self._release_player()
+        if self._bus is not None:
+            self._bus.remove_message_handler(self._on_bus_message)
+            # Disconnecting also drops the NameOwnerChanged match rule on the bus daemon.
+            try:
+                self._bus.disconnect()
+            except Exception as e:
+                log('debug', 'Failed to disconnect from DBus: ', e)
+            self._bus = None
+        # Never stop the host's loop.
+        if self._owns_loop:
+            self._loop.stop()
@@ -1,33 +1,27 @@
 from abc import ABC, abstractmethod
-import asyncio
-from dataclasses import dataclass, field
-from datetime import datetime, timezone
-from typing import Callable, Literal, TypedDict, final, override
+from dataclasses import dataclass
+from typing import Callable
 
-from lib.Logger import log
+@dataclass(slots=True, frozen=True)
+class MediaPlaybackStateInner:
+    artist: str | None = None
+    subtitle: str | None = None
+    title: str | None = None
+    is_shuffle_active: bool | None = False
+    auto_repeat_mode: str | None = None
+    playback_status: str | None = None
 
-class MediaPlaybackStateInner(TypedDict):
-    artist: str | None
-    subtitle: str | None
-    title: str | None
-    is_shuffle_active: bool | None
-    auto_repeat_mode: str | None
-    playback_status: str | None
+# States are immutable, so every caller can share the same default instance.
+_DEFAULT_MEDIA_PLAYBACK_STATE = MediaPlaybackStateInner()
 
 def default_media_playback_state() -> MediaPlaybackStateInner:
-    return MediaPlaybackStateInner(
-        artist=None,
-        subtitle=None,
-        title=None,
-        is_shuffle_active=False,
-        auto_repeat_mode=None,
-        playback_status=None
-    )
+    return _DEFAULT_MEDIA_PLAYBACK_STATE
 
 class MediaControllerBase(ABC):
-    on_media_playback_info_changed: Callable[[MediaPlaybackStateInner], None] | None = None
+    __slots__ = ("on_media_playback_info_changed",)
     def __init__(self):
         super().__init__()
+        self.on_media_playback_info_changed: Callable[[MediaPlaybackStateInner], None] | None = None
     @abstractmethod
     def play(self) -> bool: pass
     @abstractmethod
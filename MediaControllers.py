@@ -1,15 +1,29 @@
+import sys
+from typing import Callable
+
 from lib.Logger import log
 from .MediaControllerTypes import MediaControllerBase
 
+# Resolved once at import; the platform cannot change while the plugin is loaded. Linux builds may report e.g. 'linux2'.
+_OS: str = 'linux' if sys.platform.startswith('linux') else sys.platform
+
+def _mpris_controller_class() -> type[MediaControllerBase]:
+    from .MPRISController import MPRISController
+    return MPRISController
+
+def _windows_controller_class() -> type[MediaControllerBase]:
+    from .WindowsMediaController import WindowsMediaController
+    return WindowsMediaController
+
+# Maps sys.platform values to a lazy import of that platform's controller class.
+_CONTROLLER_CLASSES: dict[str, Callable[[], type[MediaControllerBase]]] = {
+    "linux": _mpris_controller_class,
+    "win32": _windows_controller_class,
+}
+
 def get_platform_controller() -> MediaControllerBase:
-    import platform
-    os_name = platform.system()
-    if os_name == "Linux":
-        from .MPRISController import MPRISController
-        return MPRISController()
-    elif os_name == "Windows":
-        from .WindowsMediaController import WindowsMediaController
-        return WindowsMediaController()
-    else:
-        log('error', f'Unsupported platform: {os_name}')
-        raise NotImplementedError(f'MediaController not implemented for {os_name}')
+    controller_class = _CONTROLLER_CLASSES.get(_OS)
+    if controller_class is None:
+        log('error', f'Unsupported platform: {_OS}')
+        raise NotImplementedError(f'MediaController not implemented for {_OS}')
+    return controller_class()()
\ No newline at end of file
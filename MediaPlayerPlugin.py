@@ -1,10 +1,13 @@
 import os
-import platform
-import random
 import subprocess
+import sys
+import time
+from random import random
+from functools import cache, partial
+from operator import methodcaller
 from typing import Any, Callable, Literal, TypedDict, cast, final, override
 
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from datetime import datetime, timedelta, timezone
 
 from openai.types.chat import ChatCompletionMessageParam
@@ -18,49 +21,121 @@ from lib.Event import Event, ProjectedEvent
 from .MediaControllerTypes import MediaPlaybackStateInner, default_media_playback_state, MediaControllerBase
 from .MediaControllers import get_platform_controller
 
-@dataclass
+# sys.platform is fixed at build time, unlike platform.system() which probes the system on each call.
+_IS_WINDOWS = sys.platform == 'win32'
+_IS_DARWIN = sys.platform == 'darwin'
+_IS_LINUX = sys.platform.startswith('linux')
+
+# Key bindings registered for the media keys playback method. Shared across registrations, do not mutate.
+_MEDIA_KEYBINDINGS: dict[str, dict[str, Any]] = {
+    'MediaPlayPause': { 'key': 162, 'mods': [], 'hold': False },
+    'MediaPreviousTrack': { 'key': 144, 'mods': [], 'hold': False },
+    'MediaNextTrack': { 'key': 153, 'mods': [], 'hold': False },
+    'MediaStop': { 'key': 164, 'mods': [], 'hold': False }
+}
+
+# Action argument -> key binding sent by pressMediaKey.
+_MEDIA_KEYS: dict[str, str] = {
+    "play_pause": 'MediaPlayPause',
+    "next": 'MediaNextTrack',
+    "previous": 'MediaPreviousTrack',
+    "stop": 'MediaStop',
+}
+
+# Action argument -> media controller command run by system_wide_media_action.
+_MEDIA_CONTROLLER_ACTIONS: dict[str, Callable[[MediaControllerBase], bool]] = {
+    "play": methodcaller('play'),
+    "pause": methodcaller('pause'),
+    "next": methodcaller('next_track'),
+    "previous": methodcaller('prev_track'),
+    "stop": methodcaller('stop'),
+}
+
+# Opens a file with its default application. Chosen once for the current platform, instead of on every call.
+if _IS_WINDOWS:
+    _open_with_default_application: Callable[[str], Any] = os.startfile
+else:
+    _OPEN_COMMAND = 'open' if _IS_DARWIN else 'xdg-open' # macOS, linux variants
+    def _open_with_default_application(path: str):
+        # Launch without waiting, the media player keeps running after the action returns.
+        subprocess.Popen((_OPEN_COMMAND, path), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+@dataclass(slots=True)
 @final
 class MediaPlaybackStateChangedEvent(Event):
-    new_state: MediaPlaybackStateInner
+    new_state: dict[str, Any] # MediaPlaybackStateInner as a plain dict, so persisted and replayed events keep the same shape.
     timestamp: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     kind: Literal['game', 'user', 'assistant', 'assistant_completed', 'tool', 'status', 'projected', 'external', 'archive'] = field(default='tool')
     processed_at: float = field(default=0.0)
     
 class MediaPlaybackState(TypedDict):
     event: str
-    media_playback_state: MediaPlaybackStateInner
+    media_playback_state: dict[str, Any] # MediaPlaybackStateInner as a plain dict, so the projected state stays serializable.
 
 class CurrentMediaPlaybackState(Projection[MediaPlaybackState]):
     @override
     def get_default_state(self) -> MediaPlaybackState:
         return MediaPlaybackState({
             'event': 'MediaState',
-            'media_playback_state': default_media_playback_state()
+            'media_playback_state': asdict(default_media_playback_state())
         })
 
     @override
     def process(self, event: Event) -> list[ProjectedEvent]:
         projected_events: list[ProjectedEvent] = []
-        if isinstance(event, MediaPlaybackStateChangedEvent):
-            self.state['media_playback_state'] = event.new_state
-            projected_events.append(ProjectedEvent({"event": "MediaPlaybackStateChanged", "new_state": event.new_state}))
+        # MediaPlaybackStateChangedEvent is final, so an exact type check replaces the isinstance MRO walk.
+        if type(event) is MediaPlaybackStateChangedEvent:
+            new_state = event.new_state
+            self.state['media_playback_state'] = new_state
+            projected_events.append(ProjectedEvent({"event": "MediaPlaybackStateChanged", "new_state": new_state}))
         return projected_events
 
 # Main plugin class
 # This is the class that will be loaded by the PluginManager.
 class MediaPlayerPlugin(PluginBase):
-    DEFAULT_PLAYBACK_METHOD: str = 'system_wide' if platform.system() in ['Windows', 'Linux'] else 'media_keys'
+    DEFAULT_PLAYBACK_METHOD: str = 'system_wide' if _IS_WINDOWS or _IS_LINUX else 'media_keys'
     DEFAULT_MEDIA_CHANGE_COMMENT_CHANCE : int = 10
     
     def __init__(self, plugin_manifest: PluginManifest): # This is the name that will be shown in the UI.
         super().__init__(plugin_manifest, event_classes = [MediaPlaybackStateChangedEvent])
 
-        self._media_controller: MediaControllerBase | None = None
-
         # Define the plugin settings
         # This is the settings that will be shown in the UI for this plugin.
-        os_name = platform.system()
-        self.settings_config: PluginSettings | None = PluginSettings(
+        self.settings_config: PluginSettings | None = self._build_settings_config()
+
+        self._media_controller: MediaControllerBase | None = None
+        # Last state put into the projection, so repeated identical states are not pushed again.
+        self._last_pushed_state: MediaPlaybackStateInner | None = None
+        # Changing the playback method requires a restart, so the setting is read once per chat and reused.
+        self._media_playback_method: str | None = None
+
+        # Playback method -> (action registrar, projection registrar). A method without projections has None.
+        self._method_registrars: dict[str, tuple[Callable[[PluginHelper], None], Callable[[PluginHelper], None] | None]] = {
+            "media_keys": (self.register_media_keys_actions, None),
+            "system_wide": (self.register_system_wide_media_actions, self.register_system_wide_media_projections),
+            "mpv": (self.register_mpv_actions, None),
+            "vlc": (self.register_vlc_actions, None),
+            "spotify": (self.register_spotify_actions, None),
+        }
+
+        # Playlists directory, resolved when the playlist action is registered.
+        self._playlists_path: str = ''
+        # Playlist names, rescanned only when the playlists directory's mtime changes.
+        self._playlists_mtime: float = 0.0
+        self._playlist_names: list[str] = []
+        # Action schema for the cached playlist names, rebuilt only when the names are rescanned.
+        self._playlist_schema: dict[str, Any] | None = None
+
+        # Status generator output for the projected state it was built from. The projection stores a new dict per
+        # state change, so an identity check tells whether the cached output is still current.
+        self._status_state: dict[str, Any] | None = None
+        self._status: list[tuple[str, Any]] = []
+
+    @classmethod
+    @cache
+    def _build_settings_config(cls) -> PluginSettings:
+        # The settings tree does not depend on the instance, so it is built once and shared by every plugin load.
+        return PluginSettings(
             key="MediaPlayerPlugin",
             label="Media Player Plugin",
             icon="music_note", # Uses Material Icons, like the built-in settings-tabs.
@@ -87,10 +162,10 @@ class MediaPlayerPlugin(PluginBase):
                             type="select",
                             readonly = False,
                             placeholder = None,
-                            default_value = self.DEFAULT_PLAYBACK_METHOD,
+                            default_value = cls.DEFAULT_PLAYBACK_METHOD,
                             select_options= [
                                 SelectOption(key="media_keys", label="Media Keys", value="media_keys", disabled=False),
-                                SelectOption(key="system_wide", label="Generic System-Wide Integration", value="system_wide", disabled=os_name != 'Windows' and os_name != 'Linux'),
+                                SelectOption(key="system_wide", label="Generic System-Wide Integration", value="system_wide", disabled=not (_IS_WINDOWS or _IS_LINUX)),
                                 SelectOption(key="mpv", label="MPV (NOT IMPLEMENTED)", value="mpv", disabled=True),
                                 SelectOption(key="vlc", label="VLC (NOT IMPLEMENTED)", value="vlc", disabled=True),
                                 SelectOption(key="spotify", label="Spotify (NOT IMPLEMENTED)", value="spotify", disabled=True),
@@ -113,7 +188,7 @@ class MediaPlayerPlugin(PluginBase):
                             type="number",
                             readonly = False,
                             placeholder = None,
-                            default_value = self.DEFAULT_MEDIA_CHANGE_COMMENT_CHANCE,
+                            default_value = cls.DEFAULT_MEDIA_CHANGE_COMMENT_CHANCE,
                             min_value = 0,
                             max_value = 100,
                             step = 1
@@ -128,25 +203,12 @@ class MediaPlayerPlugin(PluginBase):
         # Register actions
         media_playback_method = self._get_media_playback_method(helper)
 
-        if media_playback_method == "media_keys":
-            # Register media keys actions
-            self.register_media_keys_actions(helper)
-        elif media_playback_method == "system_wide":
-            # Register actions for the generic system-wide integration
-            self.register_system_wide_media_actions(helper)
-        elif media_playback_method == "mpv":
-            # Register MPV actions
-            self.register_mpv_actions(helper)
-        elif media_playback_method == "vlc":
-            # Register VLC actions
-            self.register_vlc_actions(helper)
-        elif media_playback_method == "spotify":
-            # Register Spotify actions
-            self.register_spotify_actions(helper)
-        else:
+        registrars = self._method_registrars.get(media_playback_method)
+        if registrars is None:
             log('error', f"Invalid media playback method: {media_playback_method}")
             return
-            
+        registrars[0](helper)
+
         self.register_playlist_action(media_playback_method, helper)
 
         log('debug', f"Actions registered for {self.plugin_manifest.name}")
@@ -156,31 +218,22 @@ class MediaPlayerPlugin(PluginBase):
         # Register projections
         media_playback_method = self._get_media_playback_method(helper)
 
-        if media_playback_method == "media_keys":
-            # Register media keys projections
-            pass
-        elif media_playback_method == "system_wide":
-            # Register the generic media meta data projection
-            helper.register_projection(CurrentMediaPlaybackState())
-        elif media_playback_method == "mpv":
-            # Register MPV projections
-            pass
-        elif media_playback_method == "vlc":
-            # Register VLC projections
-            pass
-        elif media_playback_method == "spotify":
-            # Register Spotify projections
-            pass
-        else:
+        registrars = self._method_registrars.get(media_playback_method)
+        if registrars is None:
             log('error', f"Invalid media playback method: {media_playback_method}")
             return
+        register_projections = registrars[1]
+        if register_projections is not None:
+            register_projections(helper)
 
         log('debug', f"Projections registered for {self.plugin_manifest.name}")
         
     @override
     def register_status_generators(self, helper: PluginHelper):
         # Register prompt generators
-        helper.register_status_generator(lambda projected_states: self.media_player_state_status_generator(helper, projected_states))
+        # Only the system-wide integration projects a media state, so the generator is only registered for it.
+        if self._get_media_playback_method(helper) == "system_wide":
+            helper.register_status_generator(partial(self.media_player_state_status_generator, helper))
     
     @override
     def on_plugin_helper_ready(self, helper: PluginHelper):
@@ -189,9 +242,11 @@ class MediaPlayerPlugin(PluginBase):
             projection = cast(CurrentMediaPlaybackState | None, helper.get_projection(CurrentMediaPlaybackState)) or None
             if projection is not None:
                 cur_state = self._media_controller.get_media_playback_state()
-                if projection.state["media_playback_state"] != cur_state:
+                if projection.state["media_playback_state"] != asdict(cur_state):
                     self._media_controller_on_media_playback_info_changed_handler(helper, cur_state)
-            self._media_controller.on_media_playback_info_changed = lambda state: self._media_controller_on_media_playback_info_changed_handler(helper, state)
+                else:
+                    self._last_pushed_state = cur_state
+            self._media_controller.on_media_playback_info_changed = partial(self._media_controller_on_media_playback_info_changed_handler, helper)
         
     @override
     def on_chat_stop(self, helper: PluginHelper):
@@ -200,12 +255,15 @@ class MediaPlayerPlugin(PluginBase):
             if self._media_controller is not None:
                 self._media_controller.cleanup()  # Cleanup the media controller
                 self._media_controller = None  # Reset the media controller
+                self._last_pushed_state = None
+        # Read the setting again when the next chat starts, since registration happens anew then.
+        self._media_playback_method = None
         log('debug', f"Executed on_chat_stop hook for {self.plugin_manifest.name}")
 
     @override
     def register_should_reply_handlers(self, helper: PluginHelper):
         if self._get_media_playback_method(helper) == "system_wide":
-            helper.register_should_reply_handler(lambda event, projected_states: self.media_player_should_reply_handler(helper, event, projected_states))
+            helper.register_should_reply_handler(partial(self.media_player_should_reply_handler, helper))
 
     # Actions
     def pressMediaKey(self, args, projected_states, helper: PluginHelper) -> str:
@@ -213,17 +271,11 @@ class MediaPlayerPlugin(PluginBase):
         key: str | None = args['key']
         if key is None:
             return "Error: No key specified."
-        if key == "play_pause":
-            helper.send_key('MediaPlayPause')
-        elif key == "next":
-            helper.send_key('MediaNextTrack')
-        elif key == "previous":
-            helper.send_key('MediaPreviousTrack')
-        elif key == "stop":
-            helper.send_key('MediaStop')
-        else:
+        media_key = _MEDIA_KEYS.get(key)
+        if media_key is None:
             return "Error: Invalid key specified."
-            
+        helper.send_key(media_key)
+
         return "Pressed media key: " + key
     def system_wide_media_action(self, args, projected_states, helper: PluginHelper) -> str:
         log('debug', 'Activating Generic Media API action: ', args)
@@ -234,20 +286,11 @@ class MediaPlayerPlugin(PluginBase):
         if self._media_controller is None:
             return "Error: Media controller is not initialized, despite using generic media integration. This should not happen."
 
-        success: bool = False
-        if action == "play":
-            success = self._media_controller.play()
-        elif action == "pause":
-            success = self._media_controller.pause()
-        elif action == "next":
-            success = self._media_controller.next_track()
-        elif action == "previous":
-            success = self._media_controller.prev_track()
-        elif action == "stop":
-            success = self._media_controller.stop()
-        else:
+        run_action = _MEDIA_CONTROLLER_ACTIONS.get(action)
+        if run_action is None:
             return "Error: Invalid action specified."
 
+        success: bool = run_action(self._media_controller)
         if not success:
             return "Error: Failed to activate Windows Media Session API action: " + action
             
@@ -255,12 +298,7 @@ class MediaPlayerPlugin(PluginBase):
 
     def register_media_keys_actions(self, helper: PluginHelper):
         # Register keybindings
-        helper.register_keybindings({
-            'MediaPlayPause': { 'key': 162, 'mods': [], 'hold': False },
-            'MediaPreviousTrack': { 'key': 144, 'mods': [], 'hold': False },
-            'MediaNextTrack': { 'key': 153, 'mods': [], 'hold': False },
-            'MediaStop': { 'key': 164, 'mods': [], 'hold': False }
-        })
+        helper.register_keybindings(_MEDIA_KEYBINDINGS)
 
         # Register media keys actions
         helper.register_action('press_media_key', "Media/Music control. Play/pause/next/previous/stop", {
@@ -268,11 +306,11 @@ class MediaPlayerPlugin(PluginBase):
             "properties": {
                 "key": {
                     "type": "string",
-                    "enum": ["play_pause", "next", "previous", "stop"],
+                    "enum": list(_MEDIA_KEYS),
                     "description": "The media key to press."
                 }
             }
-        }, lambda args, projected_states: self.pressMediaKey(args, projected_states, helper), 'global')
+        }, partial(self.pressMediaKey, helper=helper), 'global')
 
     def register_system_wide_media_actions(self, helper: PluginHelper):
         # Register system-wide media actions
@@ -282,11 +320,15 @@ class MediaPlayerPlugin(PluginBase):
             "properties": {
                 "action": {
                     "type": "string",
-                    "enum": ["play', 'pause", "next", "previous", "stop"],
+                    "enum": list(_MEDIA_CONTROLLER_ACTIONS),
                     "description": "The media player function."
                 }
             }
-        }, lambda args, projected_states: self.system_wide_media_action(args, projected_states, helper), 'global')
+        }, partial(self.system_wide_media_action, helper=helper), 'global')
+
+    def register_system_wide_media_projections(self, helper: PluginHelper):
+        # Register the generic media meta data projection
+        helper.register_projection(CurrentMediaPlaybackState())
 
     def register_mpv_actions(self, helper: PluginHelper):
         # Register MPV media player actions
@@ -307,101 +349,97 @@ class MediaPlayerPlugin(PluginBase):
         # Register playlist action
         # Find all playlist files
         playlists_path = os.path.join(helper.get_plugin_data_path(self.plugin_manifest), 'playlists')
-        if not os.path.exists(playlists_path):
-            os.makedirs(playlists_path)
+        os.makedirs(playlists_path, exist_ok=True)
+        self._playlists_path = playlists_path
 
-        files = os.listdir(playlists_path)
-        files = list(filter(lambda x: x.endswith('.m3u'), files))
-        playlist_names = list(map(lambda x: x[:-4], files))
-        log('debug', f"Discovered playlist names: {playlist_names}")
+        playlist_names = self._load_playlist_names(playlists_path)
+        log('debug', 'Discovered playlist names: ', playlist_names)
         if not playlist_names:
             log('debug', 'No playlists found, skipping playlist action registration.')
             return
 
-        helper.register_action('start_playlist', "Start a music/media playlist by name", {
-            "type": "object",
-            "properties": {
-                "playlist": {
-                    "type": "string",
-                    "enum": playlist_names,
-                    "description": "The playlist to start playing."
+        if self._playlist_schema is None:
+            self._playlist_schema = {
+                "type": "object",
+                "properties": {
+                    "playlist": {
+                        "type": "string",
+                        "enum": playlist_names,
+                        "description": "The playlist to start playing."
+                    }
                 }
             }
-        }, lambda args, projected_states: self.start_playlist(args, projected_states, media_playback_method, helper), 'global')
+        helper.register_action('start_playlist', "Start a music/media playlist by name", self._playlist_schema,
+                               partial(self.start_playlist, media_playback_method=media_playback_method, helper=helper), 'global')
+
+    def _load_playlist_names(self, playlists_path: str) -> list[str]:
+        mtime = os.stat(playlists_path).st_mtime
+        if mtime != self._playlists_mtime:
+            with os.scandir(playlists_path) as entries:
+                self._playlist_names = [entry.name[:-4] for entry in entries if entry.name.endswith('.m3u')]
+            self._playlists_mtime = mtime
+            self._playlist_schema = None
+        return self._playlist_names
 
     def start_playlist(self, args, projected_states, media_playback_method: str, helper: PluginHelper) -> str:
-        if media_playback_method == "media_keys":
-            # Start playlist using media keys
-            pass
-        elif media_playback_method == "system_wide":
-            # Start playlist using the default media player
-            pass
-        elif media_playback_method == "mpv":
-            # Start playlist using MPV
-            pass
-        elif media_playback_method == "vlc":
-            # Start playlist using VLC
-            pass
-        elif media_playback_method == "spotify":
-            # Start playlist using Spotify
-            pass
-        else:
+        if media_playback_method not in self._method_registrars:
             log('error', f"Invalid media playback method: {media_playback_method}")
             return "Error: Invalid media playback method."
 
-        # Temporary catch-all.
+        # Temporary catch-all, every playback method starts the playlist with the default media player.
         # TODO: Expand this to support other media players
-        log('debug', f"Current directory: {os.getcwd()}")
-        playlist_path: str = os.path.join(helper.get_plugin_data_path(self.plugin_manifest), 'playlists', f'{args["playlist"]}.m3u')
-        log('debug', f"Playlist path: {playlist_path}")
-        log('debug', f'Playlist file exists: {os.path.exists(playlist_path)}')
-        if platform.system() == 'Darwin':       # macOS
-            subprocess.call(('open', playlist_path))
-        elif platform.system() == 'Windows':    # Windows
-            os.startfile(playlist_path)
-        else:                                   # linux variants
-            subprocess.call(('xdg-open', playlist_path))
+        playlist_path: str = os.path.join(self._playlists_path, args["playlist"] + '.m3u')
+        log('debug', 'Playlist path: ', playlist_path)
+        _open_with_default_application(playlist_path)
 
         return 'Started playlist: ' + args['playlist']
 
     def media_player_state_status_generator(self, helper: PluginHelper, projected_states: dict[str, dict]) -> list[tuple[str, Any]]:
-        media_playback_method = self._get_media_playback_method(helper)
-        if media_playback_method != "system_wide":
-            log('debug', f'Media playback method is not system_wide ({media_playback_method}), skipping media player state status generation.')
-            return []
         state = projected_states.get('CurrentMediaPlaybackState', {}).get('media_playback_state', {})
-        log('debug', f'Adding state to context: {state}')
-        return [
-            ('Current media player state', state)
-        ]
+        if state is not self._status_state:
+            log('debug', 'Adding state to context: ', state)
+            self._status_state = state
+            self._status = [
+                ('Current media player state', state)
+            ]
+        return self._status
 
     def media_player_should_reply_handler(self, helper: PluginHelper, event: Event, projected_states: dict[str, dict]) -> bool | None:
         if isinstance(event, MediaPlaybackStateChangedEvent):
             # Check if event.timestamp is within the last 5 seconds, mostly to avoid commenting on chat startup.
-            if datetime.now(timezone.utc).timestamp() - event.processed_at <= 5:
-                cur_state = cast(MediaPlaybackStateInner, projected_states.get('CurrentMediaPlaybackState', {}).get('media_playback_state', {})) or {}
+            if time.time() - event.processed_at <= 5:
+                cur_state = projected_states.get('CurrentMediaPlaybackState', {}).get('media_playback_state', {}) or {}
                 if event.new_state == cur_state:  # Only handle event, if it's current.
                     # Decide based on chance set in media_change_assistant_comments_chance setting.
-                    chance = cast(int, helper.get_plugin_setting('MediaPlayerPlugin', 'general', 'media_change_assistant_comments_chance') or self.DEFAULT_MEDIA_CHANGE_COMMENT_CHANCE)
-                    if chance == 0:
+                    chance = cast(int | None, helper.get_plugin_setting('MediaPlayerPlugin', 'general', 'media_change_assistant_comments_chance'))
+                    # Only fall back when the setting is unset, so a configured 0 disables comments.
+                    if chance is None:
+                        chance = self.DEFAULT_MEDIA_CHANGE_COMMENT_CHANCE
+                    if chance <= 0:
                         return False
-                    if (random.random() * 100) < chance:
+                    if chance >= 100:
                         return True
-                    return False
+                    return random() < chance * 0.01
         return None # No opinion. Let the AI decide.
     
     def _media_controller_on_media_playback_info_changed_handler(self, helper: PluginHelper, state: MediaPlaybackStateInner):
+        if state == self._last_pushed_state:
+            log('debug', 'Media state did not change, skipping projection update.')
+            return
+        self._last_pushed_state = state
         log('debug', 'New media state: ', state)
-        
-        event = MediaPlaybackStateChangedEvent(state)
+
+        event = MediaPlaybackStateChangedEvent(asdict(state))
         helper.put_incoming_event(event) # Updates the projected state
 
     def _get_media_playback_method(self, helper: PluginHelper) -> str:
-        return cast(str, helper.get_plugin_setting('MediaPlayerPlugin', 'general', 'media_playback_method')) or self.DEFAULT_PLAYBACK_METHOD
+        if self._media_playback_method is None:
+            self._media_playback_method = cast(str, helper.get_plugin_setting('MediaPlayerPlugin', 'general', 'media_playback_method')) or self.DEFAULT_PLAYBACK_METHOD
+        return self._media_playback_method
     
     def new_media_event_prompt_handler(self, event: Event, helper: PluginHelper) -> list[ChatCompletionMessageParam]:
         if isinstance(event, MediaPlaybackStateChangedEvent):
-            log('debug', f'New media event: {event}')
+            log('debug', 'New media event: ', event)
             # Create a message for the assistant
             return [
                 {
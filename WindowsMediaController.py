@@ -1,90 +1,136 @@
-from abc import ABC, abstractmethod
-import asyncio
-from dataclasses import dataclass, field
-from datetime import datetime, timezone
-from typing import Callable, Literal, TypedDict, final, override
-
-from lib.Event import Event
-from lib.EventManager import Projection
-from lib.PluginHelper import PluginHelper
+from __future__ import annotations
+
+from concurrent.futures import Future
+from threading import Event, Thread
+import time
+from typing import TYPE_CHECKING, Callable, TypeVar, override
+
 from lib.Logger import log
 from .MediaControllerTypes import MediaPlaybackStateInner, default_media_playback_state, MediaControllerBase
 
+# WinRT types are only needed for annotations here; the runtime import happens in __init__.
+if TYPE_CHECKING:
+    from winrt.windows.foundation import AsyncStatus, EventRegistrationToken, IAsyncOperation
+    from winrt.windows.media.control import CurrentSessionChangedEventArgs, MediaPropertiesChangedEventArgs, PlaybackInfoChangedEventArgs, GlobalSystemMediaTransportControlsSession, GlobalSystemMediaTransportControlsSessionMediaProperties, GlobalSystemMediaTransportControlsSessionManager as MediaManager
+
+T = TypeVar('T')
+
+# Seconds to wait for media properties, so a hung media session cannot stall state refreshes.
+MEDIA_PROPERTIES_TIMEOUT = 2.0
+# Seconds without further notifications before the state is refreshed, so bursts produce one refresh.
+REFRESH_DEBOUNCE = 0.03
+# Upper bound in seconds on how long a continuous stream of notifications can postpone a refresh.
+REFRESH_DEBOUNCE_MAX_DELAY = 0.25
+
+def _wait(operation: IAsyncOperation[T], timeout: float | None = None) -> T:
+    # Block on a WinRT async operation through its completion callback, without an asyncio event loop.
+    future: Future[T] = Future()
+    def on_completed(completed_operation: IAsyncOperation[T], status: AsyncStatus):
+        try:
+            # Raises if the operation failed or was cancelled.
+            future.set_result(completed_operation.get_results())
+        except Exception as e:
+            future.set_exception(e)
+    operation.completed = on_completed
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        operation.cancel()
+        raise
+
 class WindowsMediaController(MediaControllerBase):
     # Windows backend
-    from winrt.windows.foundation import EventRegistrationToken
-    from winrt.windows.media.control import CurrentSessionChangedEventArgs, PlaybackInfoChangedEventArgs, GlobalSystemMediaTransportControlsSession, GlobalSystemMediaTransportControlsSessionMediaProperties, GlobalSystemMediaTransportControlsSessionManager as MediaManager
-    
     current_session: GlobalSystemMediaTransportControlsSession | None = None
     current_session_changed_token: EventRegistrationToken | None = None
     playback_info_changed_token: EventRegistrationToken | None = None
+    media_properties_changed_token: EventRegistrationToken | None = None
     media_session_manager: MediaManager
-    last_media_playback_state: MediaPlaybackStateInner = field(default_factory=default_media_playback_state)
 
     def __init__(self):
         super().__init__()
 
-        self.media_session_manager = asyncio.run(self._initialize_media_session_manager())
+        self.last_media_playback_state: MediaPlaybackStateInner = default_media_playback_state()
+        # Set instead of refreshing while nobody subscribes to changes; get_media_playback_state() then refreshes on demand.
+        self._state_stale: bool = False
+
+        # Notifications only flag that a refresh is needed; one worker drains the flag, so bursts collapse into one state fetch.
+        self._refresh_event: Event = Event()
+        self._refresh_stopped: bool = False
+        self._refresh_thread: Thread = Thread(target=self._refresh_worker, daemon=True)
+        self._refresh_thread.start()
+
+        # Media properties only change with the track, so they are cached and refetched when WinRT reports a change.
+        self._media_properties: GlobalSystemMediaTransportControlsSessionMediaProperties | None = None
+        self._media_properties_stale: bool = True
+
+        from winrt.windows.media.control import GlobalSystemMediaTransportControlsSessionManager as MediaManager
+        self.media_session_manager = _wait(MediaManager.request_async())
 
         # Initialize the current session and add event handlers
         self.current_session = self.media_session_manager.get_current_session()
         self.current_session_changed_token = self.media_session_manager.add_current_session_changed(self.current_session_changed_handler)
 
         if  self.current_session is not None:
-            self.playback_info_changed_token = self.current_session.add_playback_info_changed(lambda sender, event: self.playback_info_changed_handler())
+            self._add_session_handlers(self.current_session)
+
+        # Publish the initial snapshot before any notification can arrive.
+        try:
+            self.last_media_playback_state = self.get_wmsa_state()
+        except TimeoutError:
+            log('error', 'Timed out getting the initial media playback state')
+            self.last_media_playback_state = default_media_playback_state()
     
+    # Commands use the session tracked by current_session_changed_handler, instead of querying the manager each time.
     @override
-    def play(self): return asyncio.run(self._inner_play())
+    def play(self):
+        session = self.current_session
+        return session is not None and _wait(session.try_play_async())
 
     @override
-    def pause(self): return asyncio.run(self._inner_pause())
+    def pause(self):
+        session = self.current_session
+        return session is not None and _wait(session.try_pause_async())
 
     @override
-    def stop(self): return asyncio.run(self._inner_stop())
+    def stop(self):
+        session = self.current_session
+        if session is None:
+            return False
+        ret_val = _wait(session.try_stop_async())
+        if ret_val:
+            ret_val = _wait(session.try_pause_async())
+        return ret_val
 
     @override
-    def prev_track(self): return asyncio.run(self._inner_prev_track())
+    def prev_track(self):
+        session = self.current_session
+        return session is not None and _wait(session.try_skip_previous_async())
 
     @override
-    def next_track(self): return asyncio.run(self._inner_next_track())
+    def next_track(self):
+        session = self.current_session
+        return session is not None and _wait(session.try_skip_next_async())
 
     @override
-    def get_media_playback_state(self) -> MediaPlaybackStateInner: return self.get_wmsa_state()
+    def get_media_playback_state(self) -> MediaPlaybackStateInner:
+        if self._state_stale:
+            self._state_stale = False
+            try:
+                self.last_media_playback_state = self.get_wmsa_state()
+            except Exception as e:
+                log('error', 'Error getting media playback state: ', e)
+                self._state_stale = True
+        return self.last_media_playback_state
 
     @override
     def cleanup(self):
-        if self.playback_info_changed_token is not None:
-            if self.current_session is not None:
-                self.current_session.remove_playback_info_changed(self.playback_info_changed_token)
-            self.media_session_manager.get_current_session().remove_playback_info_changed(self.playback_info_changed_token)
-            self.playback_info_changed_token = None
+        self._remove_session_handlers()
         if self.current_session_changed_token is not None:
             self.media_session_manager.remove_current_session_changed(self.current_session_changed_token)
             self.current_session_changed_token = None
-
-    async def _inner_play(self) -> bool:
-        return await self.media_session_manager.get_current_session().try_play_async()
-
-    async def _inner_pause(self) -> bool:
-        return await self.media_session_manager.get_current_session().try_pause_async()
-
-    async def _inner_prev_track(self) -> bool:
-        return await self.media_session_manager.get_current_session().try_skip_previous_async()
-
-    async def _inner_next_track(self) -> bool:
-        return await self.media_session_manager.get_current_session().try_skip_next_async()
-
-    async def _inner_stop(self) -> bool:
-        ret_val = await self.media_session_manager.get_current_session().try_stop_async()
-        if ret_val:
-            ret_val = await self.media_session_manager.get_current_session().try_pause_async()
-        return ret_val
-
-    async def wmsa_get_media_properties(self, session: GlobalSystemMediaTransportControlsSession) -> GlobalSystemMediaTransportControlsSessionMediaProperties | None:
-        # log('debug', 'MediaManager: ', session)
-        # curr_session = session.get_current_session()
-        # log('debug', 'Current session: ', curr_session)
-        return await session.try_get_media_properties_async()
+        self._refresh_stopped = True
+        self._refresh_event.set()
+        self._refresh_thread.join(timeout=2)
 
     def current_session_changed_handler(self, sender: MediaManager, args: CurrentSessionChangedEventArgs):
         log('debug', 'Current session changed handler called.')
@@ -93,23 +139,84 @@ class WindowsMediaController(MediaControllerBase):
             log('debug', 'Current session did not change.')
             return
             
-        if self.playback_info_changed_token:
-            if self.current_session is not None:
-                self.current_session.remove_playback_info_changed(self.playback_info_changed_token)
-            self.playback_info_changed_token = None
+        self._remove_session_handlers()
 
         # Update the current session
         self.current_session = new_session
+        self._media_properties_stale = True
         
         if self.current_session is not None:
-            self.playback_info_changed_token = self.current_session.add_playback_info_changed(lambda sender, event: self.playback_info_changed_handler())
+            self._add_session_handlers(self.current_session)
             self.playback_info_changed_handler()
 
-    def playback_info_changed_handler(self):
+    def _add_session_handlers(self, session: GlobalSystemMediaTransportControlsSession):
+        self.playback_info_changed_token = session.add_playback_info_changed(self.playback_info_changed_handler)
+        self.media_properties_changed_token = session.add_media_properties_changed(self.media_properties_changed_handler)
+
+    def _remove_session_handlers(self):
+        if self.current_session is not None:
+            if self.playback_info_changed_token is not None:
+                self.current_session.remove_playback_info_changed(self.playback_info_changed_token)
+            if self.media_properties_changed_token is not None:
+                self.current_session.remove_media_properties_changed(self.media_properties_changed_token)
+        self.playback_info_changed_token = None
+        self.media_properties_changed_token = None
+
+    def playback_info_changed_handler(self, sender: GlobalSystemMediaTransportControlsSession | None = None, args: PlaybackInfoChangedEventArgs | None = None):
         log('debug', 'Playback info changed handler called.')
-        state = self.get_wmsa_state()
+        self._request_refresh()
+
+    def media_properties_changed_handler(self, sender: GlobalSystemMediaTransportControlsSession | None = None, args: MediaPropertiesChangedEventArgs | None = None):
+        log('debug', 'Media properties changed handler called.')
+        self._media_properties_stale = True
+        self._request_refresh()
+
+    @property
+    def on_media_playback_info_changed(self) -> Callable[[MediaPlaybackStateInner], None] | None:
+        return self._on_media_playback_info_changed
+
+    @on_media_playback_info_changed.setter
+    def on_media_playback_info_changed(self, callback: Callable[[MediaPlaybackStateInner], None] | None):
+        self._on_media_playback_info_changed = callback
+        # Changes that arrived while nobody subscribed were only marked stale, so refresh now to push them.
+        if callback is not None and self._state_stale:
+            self._state_stale = False
+            self._refresh_event.set()
 
-        if self.last_media_playback_state == state:
+    def _request_refresh(self):
+        if self.on_media_playback_info_changed is None:
+            # No subscriber: skip the WinRT work until the state is actually read.
+            self._state_stale = True
+            # Check again, in case a subscriber was attached before the flag was set.
+            if self.on_media_playback_info_changed is None:
+                return
+        self._refresh_event.set()
+
+    def _refresh_worker(self):
+        while True:
+            self._refresh_event.wait()
+            self._refresh_event.clear()
+            # Trailing-edge debounce: wait for the notifications to settle, up to the max delay.
+            deadline = time.monotonic() + REFRESH_DEBOUNCE_MAX_DELAY
+            while not self._refresh_stopped and time.monotonic() < deadline and self._refresh_event.wait(REFRESH_DEBOUNCE):
+                self._refresh_event.clear()
+            if self._refresh_stopped:
+                return
+            try:
+                state = self.get_wmsa_state()
+            except TimeoutError:
+                log('error', 'Timed out getting the media playback state')
+                continue
+            except Exception as e:
+                log('error', 'Error getting media playback state: ', e)
+                continue
+            self._publish_state(state)
+
+    def _publish_state(self, state: MediaPlaybackStateInner):
+        # While a subscriber is attached, only the refresh worker writes the state. Publishing is a single reference
+        # assignment of an immutable MediaPlaybackStateInner, so readers take the current snapshot without locking.
+        current_state = self.last_media_playback_state
+        if state is current_state or state == current_state:
             log('debug', 'Playback state did not change, skipping notification.')
             return
         self.last_media_playback_state = state
@@ -121,27 +228,34 @@ class WindowsMediaController(MediaControllerBase):
         if self.current_session is None:
             log('debug', 'Current media session is None, cannot set state.')
             return default_media_playback_state()
-        playback_info = self.current_session.get_playback_info()
-        media_properties = asyncio.run(self.wmsa_get_media_properties(self.current_session))
+        session = self.current_session
+        media_properties_operation = None
+        if self._media_properties_stale:
+            # Clear the flag before fetching, so a change during the fetch marks the cache stale again.
+            self._media_properties_stale = False
+            # Start the media properties request first, so it is in flight while the playback info is read.
+            media_properties_operation = session.try_get_media_properties_async()
+        playback_info = session.get_playback_info()
+        if media_properties_operation is not None:
+            try:
+                self._media_properties = _wait(media_properties_operation, MEDIA_PROPERTIES_TIMEOUT)
+            except Exception:
+                self._media_properties_stale = True
+                raise
+        media_properties = self._media_properties
         if media_properties is None:
             return default_media_playback_state()
-        state = MediaPlaybackStateInner({
-            'artist': media_properties.artist,
-            'subtitle': media_properties.subtitle,
-            'title': media_properties.title,
-            'is_shuffle_active': None,
-            'auto_repeat_mode': None,
-            'playback_status': None
-            })
-        if hasattr(playback_info, 'is_shuffle_active'):
-            state['is_shuffle_active'] = playback_info.is_shuffle_active or None
-        if hasattr(playback_info, 'auto_repeat_mode'):
-            state['auto_repeat_mode'] = playback_info.auto_repeat_mode or None
-        if hasattr(playback_info, 'playback_status'):
-            state['playback_status'] = playback_info.playback_status.name
-        
-        return state
+        # Single attribute lookups with a default, instead of hasattr followed by a second lookup.
+        is_shuffle_active: bool | None = getattr(playback_info, 'is_shuffle_active', None) or None
+        auto_repeat_mode: str | None = getattr(playback_info, 'auto_repeat_mode', None) or None
+        status = getattr(playback_info, 'playback_status', None)
+        playback_status: str | None = status.name if status is not None else None
 
-    async def _initialize_media_session_manager(self):
-        from winrt.windows.media.control import GlobalSystemMediaTransportControlsSessionManager as MediaManager
-        return await MediaManager.request_async()
\ No newline at end of file
+        return MediaPlaybackStateInner(
+            artist=media_properties.artist,
+            subtitle=media_properties.subtitle,
+            title=media_properties.title,
+            is_shuffle_active=is_shuffle_active,
+            auto_repeat_mode=auto_repeat_mode,
+            playback_status=playback_status
+        )